@@ -66,7 +66,7 @@ def check_vocab(ID, labels, vocab, err_file, write_file):
 if __name__ == "__main__":
     s_dir = os.fsencode(args.source_dir)
     if ((args.vocab_ref is not None) or (args.vectors_file is not None)):
-        vocab = make_vocab()
+        vocab = set(make_vocab())
     else:
         print("Sorry, I need either a vocabulary file or a vectors file. Exiting...")
         exit()
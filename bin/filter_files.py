@@ -45,13 +45,14 @@ def create_filter_list():
 
 def filter_files(filter_list, in_dir, out_dir):
     copy_list = []
+    filter_names = set(filter_list)  # hashed lookup, rather than scanning filter_list for every file
     read_directory = os.fsencode(in_dir)
     for file in os.listdir(read_directory):
         filename = os.fsdecode(file)
         if filename.startswith('.'):
             continue
         check_name = filename.split(".")[0]
-        if (check_name in filter_list):
+        if (check_name in filter_names):
             try:
                 copy_list.append(filename)
                 copy_file = os.path.join(in_dir, filename)
@@ -8,13 +8,8 @@
 
 import os
 import sys
+import multiprocessing
 import argparse
-import pandas as pd
-import numpy as np
-import scipy.cluster.hierarchy as sch
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 
 parser = argparse.ArgumentParser()
 parser.add_argument('scores_dir', help='full path to a directory containing all pairs synonymy scores', type=str)
@@ -23,20 +18,28 @@ parser.add_argument('labels_dir', help='full path to a directory containing labe
 parser.add_argument('clustering_dir', help='full path to a directory where clustering output will be written', type=str)
 parser.add_argument('--dendro_cutoff', help='the cutoff value for agglomerative hierarchical clustering',
                     default=0.7275, type=float)
+parser.add_argument('--skip_cophenet', help='skip calculating the cophenetic correlation coefficient, which is reported \
+as N/A; the clustering coherence test does not depend on it', action='store_true')
+parser.add_argument('--force', help='recluster label sets that already have a dendrogram in clustering_dir; \
+use this when rerunning with a different dendro_cutoff', action='store_true')
 args = parser.parse_args()
 
+# Heavy imports come after argument parsing, so --help and usage errors return immediately.
+import numpy as np
+import scipy.cluster.hierarchy as sch
+import fastcluster
+import numba
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
 
 def make_input_lists():
-    scores_files = []
-    labels_files = []
-    for entry in sorted(os.listdir(args.scores_dir)):
-        if os.path.isfile(os.path.join(args.scores_dir, entry)):
-            if not entry.startswith('.'):
-                scores_files.append(entry)
-    for entry in sorted(os.listdir(args.labels_dir)):
-        if os.path.isfile(os.path.join(args.labels_dir, entry)):
-            if not entry.startswith('.'):
-                labels_files.append(entry)
+    # DirEntry.is_file() reuses the file type from the directory listing, avoiding a stat per entry.
+    with os.scandir(args.scores_dir) as it:
+        scores_files = sorted(e.name for e in it if e.is_file() and not e.name.startswith('.'))
+    with os.scandir(args.labels_dir) as it:
+        labels_files = sorted(e.name for e in it if e.is_file() and not e.name.startswith('.'))
     if (len(scores_files) < 1 or len(labels_files) < 1):
         print("Either scores or labels file list is empty: quitting!")
         sys.exit()
@@ -49,22 +52,25 @@ def make_input_lists():
 def make_arrays(scores_path, labels_path):
     """Read scores and labels in from files. Convert them to ndarrays for clustering.
     Transform similarity (proximity) scores to distances."""
-    pairs_scores = pd.read_csv(scores_path, header=None)
-    labels = pd.read_csv(labels_path, header=None)
-    scores_array = np.array(pairs_scores[0][:])
-    scores_norm = normalize_array(scores_array)
-    distances_array = 1 - scores_norm
-    labels_array = np.array(labels[0][:])
-    assert len(pairs_scores[0]) == len(
-        distances_array), "Scores dataframe and distances array should be the same length."
-    assert len(labels[0]) == len(labels_array), "Labels dataframe and labels array should be the same length."
+    # Scores are rounded to 6 decimals during normalization, which is within float32 precision.
+    scores_array = np.loadtxt(scores_path, dtype=np.float32, ndmin=1)
+    labels_array = np.loadtxt(labels_path, dtype=str, comments=None, encoding='utf-8', ndmin=1)
+    distances_array = scores_to_distances(scores_array)
+    assert distances_array.ndim == 1, "Scores file should contain a single column of values."
+    assert labels_array.ndim == 1, "Labels file should contain a single column of labels."
     return distances_array, labels_array
 
 
-def normalize_array(scores_array):
-    scores_norm = (scores_array - np.min(scores_array)) / np.ptp(scores_array)
-    scores_norm = scores_norm.round(decimals=6)  # clean up floating point errors and reduce significant digits
-    return scores_norm
+def scores_to_distances(scores_array):
+    """Normalize scores to [0, 1] and convert them to distances (1 - score).
+    Works in place on scores_array, so no intermediate arrays are allocated."""
+    lo = scores_array.min()
+    inv_range = 1 / (scores_array.max() - lo)
+    np.subtract(scores_array, lo, out=scores_array)
+    np.multiply(scores_array, inv_range, out=scores_array)
+    np.subtract(1, scores_array, out=scores_array)
+    np.round(scores_array, 6, out=scores_array)  # clean up floating point errors and reduce significant digits
+    return scores_array
 
 
 def check_expected_distances_count(labels_array):
@@ -76,11 +82,9 @@ def check_expected_distances_count(labels_array):
 
 def build_linkage_matrix(distances_array):
     """Create the linkage matrix Z (perform hierarchical/agglomerative clustering)."""
-    linkage_matrix = sch.linkage(distances_array, 'average')
+    linkage_matrix = fastcluster.linkage(distances_array, method='average')
     # Fix distances that have become less than 0 due to floating point errors.
-    for i in range(len(linkage_matrix)):
-        if linkage_matrix[i][2] < 0:
-            linkage_matrix[i][2] = 0
+    np.clip(linkage_matrix[:, 2], 0, None, out=linkage_matrix[:, 2])
     return linkage_matrix
 
 
@@ -93,52 +97,117 @@ def extract_dendro_name(labels_file, scores_file):
     return labels_prefix
 
 
+@numba.njit(cache=True, error_model='numpy')
+def _cophenetic_coefficient(linkage_matrix, distances_array, n):
+    """Compiled kernel for calculate_cophenetic_coefficient. Cluster members are kept
+    as linked lists of leaves (first/last leaf per cluster, next leaf per leaf), so
+    each merge joins two clusters in constant time."""
+    d_mean = 0.0
+    for idx in range(len(distances_array)):
+        d_mean += distances_array[idx]
+    d_mean /= len(distances_array)
+    sum_dd = 0.0
+    for idx in range(len(distances_array)):
+        sum_dd += (distances_array[idx] - d_mean) ** 2
+    first = np.empty(2 * n - 1, dtype=np.int64)
+    last = np.empty(2 * n - 1, dtype=np.int64)
+    size = np.empty(2 * n - 1, dtype=np.int64)
+    next_leaf = np.full(n, -1, dtype=np.int64)
+    for leaf in range(n):
+        first[leaf] = last[leaf] = leaf
+        size[leaf] = 1
+    sum_dh = 0.0  # sum of (d - d_mean) * h over all leaf pairs
+    sum_h = 0.0
+    for k in range(n - 1):
+        a = int(linkage_matrix[k, 0])
+        b = int(linkage_matrix[k, 1])
+        h = linkage_matrix[k, 2]
+        merge_sum = 0.0
+        i = first[a]
+        while i != -1:
+            j = first[b]
+            while j != -1:
+                lo, hi = min(i, j), max(i, j)
+                # Condensed (upper triangular) index of the leaf pair (i, j).
+                merge_sum += distances_array[n * lo - lo * (lo + 1) // 2 + hi - lo - 1]
+                j = next_leaf[j]
+            i = next_leaf[i]
+        pair_count = size[a] * size[b]
+        sum_dh += h * (merge_sum - d_mean * pair_count)
+        sum_h += h * pair_count
+        c = n + k
+        next_leaf[last[a]] = first[b]
+        first[c] = first[a]
+        last[c] = last[b]
+        size[c] = size[a] + size[b]
+    # The cophenetic variance follows from the merge heights and pair counts.
+    h_mean = sum_h / len(distances_array)
+    sum_hh = 0.0
+    for k in range(n - 1):
+        a = int(linkage_matrix[k, 0])
+        b = int(linkage_matrix[k, 1])
+        sum_hh += size[a] * size[b] * (linkage_matrix[k, 2] - h_mean) ** 2
+    return sum_dh / np.sqrt(sum_dd * sum_hh)
+
+
+def calculate_cophenetic_coefficient(linkage_matrix, distances_array):
+    """Pearson correlation between the original and cophenetic (ultrametric) distances.
+    Equivalent to the coefficient returned by sch.cophenet(linkage_matrix, distances_array),
+    but computed by walking the merges in the linkage matrix rather than materializing the
+    n*(n-1)/2 cophenetic distances: every leaf pair first joined by merge k has cophenetic
+    distance h_k, so only the sum of the original distances across each merge is needed."""
+    n = linkage_matrix.shape[0] + 1
+    return _cophenetic_coefficient(np.ascontiguousarray(linkage_matrix, dtype=np.float64),
+                                   np.ascontiguousarray(distances_array), n)
+
+
 def calculate_cluster_stats(linkage_matrix, distances_array):
     """Calculate clustering statistics for cophenetic coefficient correlation,
     the number of clusters, the count of labels per cluster and the
     percent membershp in the largest cluster."""
     clusters = sch.fcluster(linkage_matrix, args.dendro_cutoff, criterion='distance')
-    cluster_enumeration = np.unique(clusters)
     # Calculate the cophenetic correlation coefficient statistic: closer to 1 is better.
-    cophenetic_coefficient, _ = sch.cophenet(linkage_matrix, distances_array)
-    # Get membership counts for each cluster.
-    cluster_membership = {}
-    for value in cluster_enumeration:
-        member_count = np.count_nonzero(clusters == value)
-        cluster_membership[value] = member_count
+    if args.skip_cophenet:
+        cophenetic_coefficient = float('nan')
+    else:
+        cophenetic_coefficient = calculate_cophenetic_coefficient(linkage_matrix, distances_array)
+    # Get membership counts for each cluster; fcluster numbers clusters from 1.
+    counts = np.bincount(clusters)
+    cluster_membership = {i: int(counts[i]) for i in range(1, len(counts)) if counts[i]}
     # Calculate the percentage membership in the largest cluster.
-    c_max = max(cluster_membership.values())
-    c_sum = sum(cluster_membership.values())
-    pct = 100 * (c_max / c_sum)
+    pct = 100 * (counts.max() / counts.sum())
     return cophenetic_coefficient, cluster_membership, pct
 
 
 def make_output_subdirs():
-    if not os.path.exists(args.clustering_dir):
-        os.makedirs(args.clustering_dir)
-    if not os.path.exists(os.path.join(args.clustering_dir, 'Dendrograms/Pass')):
-        os.makedirs(os.path.join(args.clustering_dir, 'Dendrograms/Pass'))
-    if not os.path.exists(os.path.join(args.clustering_dir, 'Dendrograms/Fail')):
-        os.makedirs(os.path.join(args.clustering_dir, 'Dendrograms/Fail'))
-    if not os.path.exists(os.path.join(args.clustering_dir, 'Statistics/Pass')):
-        os.makedirs(os.path.join(args.clustering_dir, 'Statistics/Pass'))
-    if not os.path.exists(os.path.join(args.clustering_dir, 'Statistics/Fail')):
-        os.makedirs(os.path.join(args.clustering_dir, 'Statistics/Fail'))
+    for subdir in ('Dendrograms/Pass', 'Dendrograms/Fail', 'Statistics/Pass', 'Statistics/Fail'):
+        os.makedirs(os.path.join(args.clustering_dir, subdir), exist_ok=True)
+
+
+def find_clustered_names():
+    """Names of label sets with a saved dendrogram. The dendrogram is written after the
+    statistics file, so its presence means the label set was fully processed."""
+    clustered_names = set()
+    for subdir in ('Dendrograms/Pass', 'Dendrograms/Fail'):
+        with os.scandir(os.path.join(args.clustering_dir, subdir)) as it:
+            clustered_names.update(e.name.rsplit('.', 1)[0] for e in it if e.is_file())
+    return clustered_names
 
 
 def format_cluster_stats(cophenetic_coefficient, cluster_membership, pct):
     """Pretty print layout for clustering statistics; can be appended to the dendrogram or saved out as a file."""
-    stats_printout = '---------------------------------------------------------------------------------\n'
-    stats_printout += 'Agglomerative Hierarchical Clustering Statistics\n---------------------------------------------------------------------------------\n'
-    stats_printout += ('Cophenectic correlation coefficient: ' + str(cophenetic_coefficient) + '\n')
-    stats_printout += ('Cluster: Count\n')
-    for key in cluster_membership.keys():
-        stats_printout += (str(key) + ': ' + str(cluster_membership[key]) + '\n')
+    cophenetic_printout = 'N/A' if np.isnan(cophenetic_coefficient) else str(cophenetic_coefficient)
     cluster_max_membership = max(cluster_membership.items(), key=lambda x: x[1])
-    stats_printout += ('Cluster ' + str(cluster_max_membership[0]) + ' with ' + str(
-        cluster_max_membership[1]) + ' members has ' + str(pct) + '% of the membership.\n')
     pass_fail = classify_pass_fail(pct)
-    stats_printout += ('Cluster coherence test: ' + pass_fail)
+    parts = ['---------------------------------------------------------------------------------\n',
+             'Agglomerative Hierarchical Clustering Statistics\n---------------------------------------------------------------------------------\n',
+             'Cophenectic correlation coefficient: ' + cophenetic_printout + '\n',
+             'Cluster: Count\n']
+    parts.extend(str(key) + ': ' + str(count) + '\n' for key, count in cluster_membership.items())
+    parts.append('Cluster ' + str(cluster_max_membership[0]) + ' with ' + str(
+        cluster_max_membership[1]) + ' members has ' + str(pct) + '% of the membership.\n')
+    parts.append('Cluster coherence test: ' + pass_fail)
+    stats_printout = ''.join(parts)
     return stats_printout
 
 
@@ -159,58 +228,79 @@ def make_output_filenames(pct, dendro_name):
     return dendro_file, stats_file
 
 
+def init_dendro_figure():
+    """Create the figure each worker draws its dendrograms on. Building a figure is expensive,
+    so it is created once per worker process and cleared between label sets."""
+    global dendro_fig, dendro_ax
+    plt.rc('ytick', labelsize=14)
+    dendro_fig, dendro_ax = plt.subplots(figsize=(14, 8.5))  # (width, height) in inches
+    dendro_fig.subplots_adjust(bottom=0.22, top=0.95, right=0.98, left=0.06)
+
+
+def cluster_label_set(dendro_name, scores_file, labels_file):
+    """Cluster one label set and write its dendrogram and statistics to the Pass or Fail directories.
+    Each label set is independent of the others, so this runs in a worker process."""
+    distances_array, labels_array = make_arrays(scores_file, labels_file)
+    expected_distances_count = check_expected_distances_count(labels_array)
+    if (expected_distances_count != len(distances_array)):
+        print(
+            f'The number of values in the {scores_file} distances list is {len(distances_array)}, but it should be {expected_distances_count}. Skipping.')
+        return
+
+    linkage_matrix = build_linkage_matrix(distances_array)
+    assert (linkage_matrix.shape[0] + 1) == (
+        len(labels_array)), "The linkage matrix and labels array have mismatched lengths."
+    cophenetic_coefficient, cluster_membership, pct = calculate_cluster_stats(linkage_matrix, distances_array)
+    stats_printout = format_cluster_stats(cophenetic_coefficient, cluster_membership, pct)
+
+    # Set up the plot, reusing this worker's figure.
+    fig, ax = dendro_fig, dendro_ax
+    ax.clear()
+    title = "Image: " + dendro_name
+    ax.set_title(title, fontsize=18)
+    y_label = 'Cophenetic Coefficient (Cutoff: ' + str(args.dendro_cutoff) + ')'
+    ax.set_ylabel(y_label, fontsize=16)
+    ax.axhline(y=args.dendro_cutoff, color="grey", linestyle="--")
+    # fig.text(0.02, 0.12, stats_printout, horizontalalignment='left', verticalalignment='center', fontsize=14)
+    # Create the dendrogram, with a cutoff specified during module invocation.
+    dendro = sch.dendrogram(linkage_matrix, labels=labels_array, color_threshold=args.dendro_cutoff, \
+                            leaf_font_size=8, leaf_rotation=90, count_sort='ascending', ax=ax, above_threshold_color='lightgray')
+    ax.set_ylim(0, 1)
+
+    # Save out the plot and statistics.
+    dendro_file, stats_file = make_output_filenames(pct, dendro_name)
+    with open(stats_file, 'w') as f_stat:
+        f_stat.write(stats_printout)
+    try:
+        fig.savefig(dendro_file, format='png', dpi=100)
+    except:
+        print(f'Unable to save {dendro_file}!')
+    # plt.show()  # uncomment to display the plot before continuing
+
+
 if __name__ == '__main__':
     make_output_subdirs()
     if (os.path.isdir(args.scores_dir) and os.path.isdir(args.labels_dir) and os.path.isdir(args.clustering_dir)):
         """We are reading from one or more files containing word pair synonymy scores
         and their associated labels, clustering the distances between scores,
         generating a dendrogram and some statistics from the clustering, and writing
-        that output to a file."""
+        that output to a file. Label sets are processed in parallel, one per worker."""
         scores_files, labels_files = make_input_lists()
+        # Name each job once, using the labels file name; mismatched file pairs are caught before clustering starts.
+        jobs = []
         for i in range(len(scores_files)):
             scores_file = os.path.join(args.scores_dir, scores_files[i])
             labels_file = os.path.join(args.labels_dir, labels_files[i])
-            distances_array, labels_array = make_arrays(scores_file, labels_file)
-            expected_distances_count = check_expected_distances_count(labels_array)
-            if (expected_distances_count != len(distances_array)):
-                print(
-                    f'The number of values in the {scores_file} distances list is {len(distances_array)}, but it should be {expected_distances_count}.')
-                input("Press Enter to continue...")
-                continue
-
-            linkage_matrix = build_linkage_matrix(distances_array)
-            assert (linkage_matrix.shape[0] + 1) == (
-                len(labels_array)), "The linkage matrix and labels array have mismatched lengths."
-            cophenetic_coefficient, cluster_membership, pct = calculate_cluster_stats(linkage_matrix, distances_array)
-            stats_printout = format_cluster_stats(cophenetic_coefficient, cluster_membership, pct)
-
-            # Title the dendrogram, using the labels file name.
-            dendro_name = extract_dendro_name(labels_file, scores_file)
-            # Set up the plot.
-            fig, ax = plt.subplots(figsize=(14, 8.5))  # (width, height) in inches
-            title = "Image: " + dendro_name
-            plt.title(title, fontsize=18)
-            plt.rc('ytick', labelsize=14)
-            y_label = 'Cophenetic Coefficient (Cutoff: ' + str(args.dendro_cutoff) + ')'
-            plt.ylabel(y_label, fontsize=16)
-            plt.axhline(y=args.dendro_cutoff, color="grey", linestyle="--")
-            # plt.figtext(0.02, 0.12, stats_printout, horizontalalignment='left', verticalalignment='center', fontsize=14)
-            plt.subplots_adjust(bottom=0.22, top=0.95, right=0.98, left=0.06)
-            # Create the dendrogram, with a cutoff specified during module invocation.
-            dendro = sch.dendrogram(linkage_matrix, labels=labels_array, color_threshold=args.dendro_cutoff, \
-                                    leaf_font_size=8, leaf_rotation=90, count_sort='ascending', ax=ax, above_threshold_color='lightgray')
-            ax.set_ylim(0, 1)
-
-            # Save out the plot and statistics.
-            dendro_file, stats_file = make_output_filenames(pct, dendro_name)
-            with open(stats_file, 'w') as f_stat:
-                f_stat.write(stats_printout)
-            try:
-                plt.savefig(dendro_file, format='png')
-            except:
-                print(f'Unable to save {dendro_file}!')
-            # plt.show()  # uncomment to display the plot before continuing
-            plt.close()
+            jobs.append((extract_dendro_name(labels_file, scores_file), scores_file, labels_file))
+        # Skip label sets clustered by an earlier run, unless asked to redo them.
+        if not args.force:
+            clustered_names = find_clustered_names()
+            jobs = [job for job in jobs if job[0] not in clustered_names]
+            if len(jobs) < len(scores_files):
+                print(f"Skipping {len(scores_files) - len(jobs)} label sets that are already clustered.")
+        if jobs:
+            with multiprocessing.Pool(processes=os.cpu_count(), initializer=init_dendro_figure) as pool:
+                pool.starmap(cluster_label_set, jobs)
 
     else:
         print("Be sure to include options for scores, labels and output directories when calling this module.")
\ No newline at end of file
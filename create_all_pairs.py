@@ -43,9 +43,8 @@ def generate_all_pairs():
         with open(in_file, 'r', encoding="utf-8") as f: #hrat069
             label_list = [line.rstrip('\n') for line in f]
             with open(out_file, 'w', encoding="utf-8") as o: #hrat069
-                for i in range(len(label_list)):
-                    for j in range(i + 1, (len(label_list))):
-                        o.write("{} {}\n".format(label_list[i], label_list[j]))
+                o.writelines("{} {}\n".format(label_list[i], label_list[j])
+                             for i in range(len(label_list)) for j in range(i + 1, len(label_list)))
 
 
 if __name__ == "__main__":
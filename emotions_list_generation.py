@@ -1,33 +1,37 @@
 import os
 import re
+from collections import Counter
 
-with (open(os.path.join("files/emotions.txt"), 'r', encoding='utf-8') as file):
-    emotions_dict = {}
+# Matches an emotion entry with a count, e.g. "happy (3)". Entries are matched as bytes,
+# and only decoded when written out.
+EMOTION_COUNT_PATTERN = re.compile(rb'^(.*?)\s*\((.*?)\)$')
+
+with (open(os.path.join("files/emotions.txt"), 'rb') as file):
+    emotions_dict = Counter()
     emotion_list_2 = []
+    seen_emotions_2 = set()
 
-    for line in file:
-        values = [value.strip() for value in line.split(',')]
+    for line in file.read().splitlines():
+        values = [value.strip() for value in line.split(b',')]
         for item in values:
-            match = re.match(r'^(.*?)\s*\((.*?)\)$', item)
+            match = EMOTION_COUNT_PATTERN.match(item)
             if match:
                 key, value = match.groups()
                 key, value = key.strip(), int(value.strip())
             else:
                 key, value = item.strip(), 1
-            if len(key.split(" ")) == 1:
-                if key in emotions_dict:
-                    emotions_dict[key] = emotions_dict[key] + value
-                else:
-                    emotions_dict[key] = value
+            if len(key.split(b" ")) == 1:
+                emotions_dict[key] += value
             else:
-                if key not in emotion_list_2:
+                if key not in seen_emotions_2:
+                    seen_emotions_2.add(key)
                     emotion_list_2.append(key)
-    sorted_dict = dict(sorted(emotions_dict.items(), key=lambda item: item[1], reverse=True))
+    # Counter.most_common sorts by count with operator.itemgetter; a list of pairs is all the writer needs.
+    ranked_emotions = emotions_dict.most_common()
 
 
+# Each word list is built as one string and written in a single call.
 with open(os.path.join("files/word_lists/2.txt"), 'w', encoding='utf-8') as file:
-    for item in sorted_dict.keys():
-        file.write(f'{item}   {sorted_dict[item]}\n')
+    file.write(''.join(f'{item.decode("utf-8")}   {count}\n' for item, count in ranked_emotions))
 with open(os.path.join("files/word_lists/3.txt"), 'w', encoding='utf-8') as file:
-    for item in emotion_list_2:
-        file.write(f'{item}\n')
\ No newline at end of file
+    file.write(''.join(f'{item.decode("utf-8")}\n' for item in emotion_list_2))
\ No newline at end of file
@@ -17,6 +17,8 @@ import os
 import shutil
 import argparse
 import math
+import pickle
+import tempfile
 import numpy as np
 np.seterr(divide='ignore', invalid='ignore')  # fix runtime error when dividing by zero
 
@@ -67,7 +69,7 @@ def generate():
             # The vocabulary file gets created here, if one wasn't provided on script invocation.
             if args.vocab_file is None:
                 words.append(vals[0])
-            vectors[vals[0]] = [float(x) for x in vals[1:]]
+            vectors[vals[0]] = np.array(vals[1:], dtype=np.float64)  # parsed in C, stored without per-value float objects
         vector_dim = len(vals) - 1  # Number of features in a semantic vector, minus the vocab word at the beginning.
         vocab_size = len(words)
 
@@ -89,6 +91,34 @@ def generate():
     return (W_norm, vocab)
 
 
+def load_vectors():
+    """Return the normalized vectors and vocabulary from generate(), caching them in a pickle
+    sidecar next to vectors_file. The cache is reused while it is newer than vectors_file.
+    Runs given a vocab_file bypass the cache, since generate() output depends on it."""
+    if args.vocab_file is not None:
+        return generate()
+    cache_file = args.vectors_file + ".pkl"
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(args.vectors_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, OSError):
+            print(f'Unable to read cached vectors from {cache_file}; regenerating them.')
+    W_norm, vocab = generate()
+    # Write to a temporary file first, so an interrupted dump never leaves a partial cache behind.
+    tmp_file = None
+    try:
+        fd, tmp_file = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(cache_file)))
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((W_norm, vocab), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        print(f'Unable to cache vectors to {cache_file}.')
+        if tmp_file is not None and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return (W_norm, vocab)
+
+
 def distance(W, vocab, input_term1, input_term2):
     if input_term1 not in vocab or input_term2 not in vocab:
         # Magic number to indicate that some word wasn't in the vocabulary.
@@ -101,7 +131,7 @@ def distance(W, vocab, input_term1, input_term2):
 
 
 if __name__ == "__main__":
-    W, vocab = generate() # (hrat069 - W have a map between word index and vectors. vocab has a map between word index and word.)
+    W, vocab = load_vectors() # (hrat069 - W have a map between word index and vectors. vocab has a map between word index and word.)
     if args.source_dir is not None and args.output_dir is not None:
         # We are reading from one or more files containing word pair lists, and writing
         # pairwise relatedness scores to an output file.
@@ -134,7 +164,7 @@ if __name__ == "__main__":
 
                         # Calculate relatedness scores.
                         linecnt = n_minus
-                        label_list = [] # hrat069
+                        label_list = set() # hrat069 (labels already written to f_lab)
                         terms_not_in_vocab = []
                         for line in f_in:
                             # Keeping track of when to write to the labels file.
@@ -164,10 +194,10 @@ if __name__ == "__main__":
                                     # if ((linecnt == 1) and (n_minus == 1)):  # (hrat069) - moved the indentation one level to the begin.
                                     #     f_lab.write("%s\n" % (array[1]))
                                     if array[0] not in label_list: #hrat069
-                                        label_list.append(array[0])
+                                        label_list.add(array[0])
                                         f_lab.write("%s\n" % (array[0]))
                                     if array[1] not in label_list: #hrat069
-                                        label_list.append(array[1])
+                                        label_list.add(array[1])
                                         f_lab.write("%s\n" % (array[1]))    
                                 linecnt -= 1
                             except: